@@ -1,33 +1,199 @@
-from typing import Annotated, Sequence
+from typing import Annotated, Optional, Self, Sequence, TypedDict
 from dotenv import load_dotenv
+import asyncio
+import hashlib
+import json
 import os
+import shutil
+import time
 from rich.console import Console
+from rich.live import Live
 from rich.panel import Panel
 from rich.markdown import Markdown
 from rich.syntax import Syntax
+from rich.table import Table
+from rich.text import Text
 
+import anyio
+import httpx
 from langchain_anthropic import ChatAnthropic
+from langchain_anthropic.chat_models import convert_to_anthropic_tool
 from langchain_core.messages import (
     BaseMessage,
     AIMessage,
     HumanMessage,
+    RemoveMessage,
     SystemMessage,
     ToolMessage,
+    message_chunk_to_message,
 )
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph
-from pydantic import BaseModel
+from pydantic import Field, model_validator
 from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode
 from tools.run_unit_tests_tool import run_unit_tests
+from mcp.shared.exceptions import McpError
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+import aiosqlite
+import orjson
 
 # import sqlite3
-# import aiosqlite
 
+SYSTEM_PROMPT = """You are a specialised agent for maintaining and developing codebases.
+            ## Development Guidelines:
+
+            1. **Test Failures:**
+            - When tests fail, fix the implementation first, not the tests.
+            - Tests represent expected behavior; implementation should conform to tests
+            - Only modify tests if they clearly don't match specifications
+
+            2. **Code Changes:**
+            - Make the smallest possible changes to fix issues
+            - Focus on fixing the specific problem rather than rewriting large portions
+            - Add unit tests for all new functionality before implementing it
+
+            3. **Best Practices:**
+            - Keep functions small with a single responsibility
+            - Implement proper error handling with appropriate exceptions
+            - Be mindful of configuration dependencies in tests
+
+            4. **Tool Use:**
+            - When a task needs several steps that don't depend on your reasoning in between (computing, transforming or checking data), write them as one Python program and run it with a single `run_python_code` call instead of one tool call per step
+            - The Python sandbox cannot see local files or run tests; use the file and test tools for those, and batch independent tool calls into the same turn
+
+            Ask for clarification when needed. Remember to examine test failure messages carefully to understand the root cause before making any changes."""
+
+# Tool results at least this long (~1k tokens) get a cache breakpoint so the history up to
+# them is served from Anthropic's cache. This is a cost heuristic: cache writes cost more than
+# plain input, so small results are not worth one (the API's own minimum applies to the whole
+# prefix, which the system prompt and tools already exceed). Tools, system prompt, working
+# directory and this tool result use all 4 breakpoints the API allows; a fifth gets a 400
+TOOL_RESULT_CACHE_MIN_CHARS = 4096
+
+# History compression: once everything before the last SUMMARY_KEEP_TURNS user turns exceeds
+# this many characters, it is replaced by a model-written summary. The kept turns are not
+# counted, so large recent turns do not trigger a re-summary on every turn
+SUMMARY_THRESHOLD_CHARS = 40_000
+SUMMARY_KEEP_TURNS = 2
+SUMMARY_PROMPT = (
+    "Summarize the following conversation between a user and a coding agent. "
+    "Preserve file paths, tool results and decisions that later turns may rely on."
+)
+
+# Redraws per second of the assistant panel while a reply streams in
+STREAM_REFRESH_PER_SECOND = 8
+
+# Read-only tools whose results are reused for identical (name, args) calls in a session
+CACHEABLE_TOOLS = frozenset(
+    {"file_read", "read_file", "run_unit_tests", "search", "fetch_content"}
+)
+# Cached tools whose results depend on local files. They are dropped at every user prompt,
+# since the user may have edited files meanwhile, and after any other tool succeeds, since
+# that tool may have written to disk
+FILE_DEPENDENT_TOOLS = frozenset({"file_read", "read_file", "run_unit_tests"})
+
+# Rendered workflow diagrams, keyed by a hash of the graph's Mermaid source
+MERMAID_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "agent")
+
+# Health-check retry when opening an MCP server session at startup
+MCP_CONNECT_ATTEMPTS = 3
+MCP_CONNECT_RETRY_DELAY = 2.0
+# Errors meaning an MCP server is not reachable or up yet: the process/socket failed, or
+# the stream closed before the MCP handshake completed
+MCP_STARTUP_ERRORS = (
+    OSError,
+    httpx.TransportError,
+    McpError,
+    anyio.BrokenResourceError,
+    anyio.ClosedResourceError,
+    anyio.EndOfStream,
+)
+
+
+def _content_text(content) -> str:
+    """
+    Join the text of a message's content, which is either a string or a list of blocks.
+    """
+    if isinstance(content, str):
+        return content
+    return "\n\n".join(
+        block.get("text", "")
+        for block in content
+        if isinstance(block, dict) and block.get("type") == "text" and block.get("text")
+    )
+
+
+def _is_mcp_startup_error(exc: BaseException) -> bool:
+    """
+    True if `exc` (or every error in an exception group raised by the transport's
+    task group) means the server is not up yet and the connection may be retried.
+    """
+    if isinstance(exc, BaseExceptionGroup):
+        return all(_is_mcp_startup_error(e) for e in exc.exceptions)
+    return isinstance(exc, MCP_STARTUP_ERRORS)
+
+
+def _tool_cache_key(tool_call) -> tuple[str, str]:
+    args = json.dumps(tool_call["args"], sort_keys=True).encode()
+    return tool_call["name"], hashlib.blake2b(args, digest_size=16).hexdigest()
+
+
+class OrjsonSerde(JsonPlusSerializer):
+    """
+    JsonPlusSerializer with its JSON path on orjson. Datetimes and dataclasses, which
+    JsonPlusSerializer encodes as constructor dicts, are passed through to its default hook
+    so they still round-trip to the same objects. Subclasses of dict/list/str (such as
+    LangGraph's step metadata) are serialized natively, as the stdlib encoder does.
+    """
+
+    _OPTIONS = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj, default=self._default, option=self._OPTIONS)
+
+    def loads(self, data):
+        return self._revive(orjson.loads(data))
 
-class AgentState(BaseModel):
+    def _revive(self, value):
+        # orjson has no object_hook; apply the reviver bottom-up like json.loads would
+        if isinstance(value, dict):
+            return self._reviver({k: self._revive(v) for k, v in value.items()})
+        if isinstance(value, list):
+            return [self._revive(v) for v in value]
+        return value
+
+
+class PooledChatAnthropic(ChatAnthropic):
+    """
+    ChatAnthropic whose async API client sends requests through a caller-owned httpx.AsyncClient,
+    so connection pooling, keepalive and HTTP/2 can be configured.
+    """
+
+    http_async_client: Optional[httpx.AsyncClient] = Field(default=None, exclude=True)
+
+    # Replaces ChatAnthropic.post_init (same name), which builds the API clients
+    @model_validator(mode="after")
+    def post_init(self) -> Self:
+        super().post_init()
+        if self.http_async_client is not None:
+            # copy() keeps the key, base URL, retries, timeout and headers just configured
+            self._async_client = self._async_client.copy(
+                http_client=self.http_async_client
+            )
+        return self
+
+
+class AgentState(TypedDict):
     """
     Persistent agent state tracked across the graph.
     - messages: complete chat history (system + user + assistant + tool messages)
+    A TypedDict rather than a pydantic model, so node transitions don't re-validate the history.
     """
 
     messages: Annotated[Sequence[BaseMessage], add_messages]
@@ -43,40 +209,53 @@ class Agent:
             raise RuntimeError(
                 "Missing ANTHROPIC_API_KEY in environment. Set it in .env or your shell."
             )
+        self._github_pat = os.getenv("GITHUB_PERSONAL_ACCESS_TOKEN")
+
+        # One pooled HTTP/2 client for all API calls; the long keepalive keeps the connection
+        # (and its TLS session) alive while the agent waits at the user prompt
+        self._http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=600),
+            timeout=httpx.Timeout(120.0),
+        )
 
         # Model instantiation (Claude Sonnet latest)
-        self.model = ChatAnthropic(
+        self.model = PooledChatAnthropic(
             model="claude-3-7-sonnet-latest",
             temperature=0.3,
             max_tokens=4096,
             api_key=api_key,
+            # Passed to the API client explicitly, so it overrides the httpx client's timeout
+            default_request_timeout=120.0,
+            http_async_client=self._http_client,
         )
 
         # Rich console for UI
         self.console = Console()
 
-        # Build workflow graph
-        self.workflow = StateGraph(AgentState)
-
-        # Register nodes
-        self.workflow.add_node("user_input", self.user_input)
-        self.workflow.add_node("model_response", self.model_response)
-        self.workflow.add_node("tool_use", self.tool_use)
-
-        # Edges: start at user_input
-        self.workflow.set_entry_point("user_input")
-        self.workflow.add_edge("user_input", "model_response")
-        self.workflow.add_edge("tool_use", "model_response")
-
-        # Conditional: model_response -> tool_use OR -> user_input
-        self.workflow.add_conditional_edges(
-            "model_response",
-            self.check_tool_use,
-            {
-                "tool_use": "tool_use",
-                "user_input": "user_input",
-            },
-        )
+        # Static prompt prefix, built once so it is byte-identical on every turn
+        # and both blocks can be served from Anthropic's prompt cache
+        self._cwd = os.getcwd()
+        self._prefix_messages = [
+            SystemMessage(
+                content=[
+                    {
+                        "type": "text",
+                        "text": SYSTEM_PROMPT,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ]
+            ),
+            HumanMessage(
+                content=[
+                    {
+                        "type": "text",
+                        "text": f"Working directory: {self._cwd}",
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ]
+            ),
+        ]
 
     async def initialize(self):
         """Async initialization - load tools and other async resources"""
@@ -96,20 +275,41 @@ class Agent:
         )
         self._initialized = True
 
-        # Bind tools to model
-        self.model_with_tools = self.model.bind_tools(self.tools)
+        # Bind tools to model: convert the schemas to Anthropic's format once and mark
+        # the last tool so the whole tool list is cached server-side as part of the prefix
+        self._tools_payload = [convert_to_anthropic_tool(t) for t in self.tools]
+        if self._tools_payload:
+            self._tools_payload[-1] = {
+                **self._tools_payload[-1],
+                "cache_control": {"type": "ephemeral"},
+            }
+        self.model_with_tools = self.model.bind(tools=self._tools_payload)
+
+        # One ToolNode for all tools; it dispatches every tool call of a message concurrently
+        self._tool_node = ToolNode(self.tools)
+        self._tools_by_name = {t.name: t for t in self.tools}
+        self._tool_cache: dict[tuple[str, str], ToolMessage] = {}
 
-        # Compile graph
-        async with AsyncSqliteSaver.from_conn_string("checkpoints.db") as memory:
-            self.agent = self.workflow.compile(checkpointer=memory)
-        # Compile graph: enter AsyncSqliteSaver once and keep it open for agent lifetime
+        # Compile graph: open the checkpoint DB once and keep it open for agent lifetime
         # (prevents re-opening/closing aiosqlite threads repeatedly)
-        db_path = os.path.join(os.getcwd(), "checkpoints.db")
-        self._checkpointer_ctx = AsyncSqliteSaver.from_conn_string(db_path)
-        self.checkpointer = await self._checkpointer_ctx.__aenter__()
-        self.agent = self.workflow.compile(checkpointer=self.checkpointer)
+        db_path = os.path.join(self._cwd, "checkpoints.db")
+        self._checkpoint_conn = await aiosqlite.connect(db_path)
+        # The saver's setup() already switches the DB to WAL. synchronous=NORMAL then skips
+        # the fsync on each checkpoint commit; a power loss can drop the last few
+        # checkpoints but cannot corrupt the DB
+        await self._checkpoint_conn.execute("PRAGMA synchronous=NORMAL")
+        serde = OrjsonSerde()
+        self.checkpointer = AsyncSqliteSaver(self._checkpoint_conn, serde=serde)
+        # Checkpoint metadata (which carries each step's writes) goes through the saver's
+        # own JSON serializer rather than `serde`, so switch that one to orjson too
+        self.checkpointer.jsonplus_serde = serde
+        self.agent = WORKFLOW.compile(checkpointer=self.checkpointer)
+        return self
 
-        # Optional: print a greeting panel
+    def print_greeting(self):
+        """
+        Print the ready panel. Kept out of initialize() so callers decide when to render it.
+        """
         self.console.print(
             Panel.fit(
                 Markdown("**LangGraph Coding Agent** — Claude Code Clone"),
@@ -117,84 +317,135 @@ class Agent:
                 border_style="green",
             )
         )
-        return self
 
     async def run(self):
         """
         Main loop: invoke the workflow repeatedly, never exits automatically.
         """
-        config = {"configurable": {"thread_id": "1"}}
+        config = {"configurable": {"thread_id": "1", "agent": self}}
         return await self.agent.ainvoke(
             {"messages": AIMessage(content="What can I do for you?")}, config=config
         )
 
-    async def close_checkpointer(self):
-        """Close the async checkpointer context if opened."""
-        if hasattr(self, "_checkpointer_ctx"):
-            await self._checkpointer_ctx.__aexit__(None, None, None)
+    async def aclose(self):
+        """Close the checkpointer, MCP sessions and HTTP client if opened."""
+        if hasattr(self, "_checkpoint_conn"):
+            await self._checkpoint_conn.close()
+        if hasattr(self, "_mcp_tasks"):
+            await self._close_mcp_sessions()
+        await self._http_client.aclose()
 
     async def get_mcp_tools(self):
         from langchain_mcp_adapters.client import MultiServerMCPClient
 
-        GITHUB_PERSONAL_ACCESS_TOKEN = os.getenv("GITHUB_PERSONAL_ACCESS_TOKEN")
-        mcp_client = MultiServerMCPClient(
-            {
-                "Run_Python_MCP": {
-                    "command": "docker",
-                    "args": [
-                        "run",
-                        "-i",
-                        "--rm",
-                        "deno-docker:latest",  # image name
-                        "deno",  # the command inside container
-                        "run",
-                        "-N",
-                        "-R=node_modules",
-                        "-W=node_modules",
-                        "--node-modules-dir=auto",
-                        "jsr:@pydantic/mcp-run-python",
-                        "stdio",
-                    ],
-                    "transport": "stdio",
-                },
-                "duckduckgo_MCP": {
-                    "command": "docker",
-                    "args": ["run", "-i", "--rm", "mcp/duckduckgo"],
-                    "transport": "stdio",
-                },
-                "desktop_commander_in_docker_MCP": {
-                    "command": "docker",
-                    "args": [
-                        "run",
-                        "-i",
-                        "--rm",
-                        "-v",
-                        "/Users/lorreatlan/Documents/MyPlayDocuments:/mnt/documents",
-                        "mcp/desktop-commander:latest",
-                    ],
-                    "transport": "stdio",
-                },
-                "Github_MCP": {
-                    "command": "docker",
-                    "args": [
-                        "run",
-                        "-i",
-                        "--rm",
-                        "-e",
-                        f"GITHUB_PERSONAL_ACCESS_TOKEN={GITHUB_PERSONAL_ACCESS_TOKEN}",
-                        "-e",
-                        "GITHUB_READ-ONLY=1",
-                        "ghcr.io/github/github-mcp-server",
-                    ],
-                    "transport": "stdio",
-                },
-            }
-        )
-        mcp_tools = await mcp_client.get_tools()
+        connections = {
+            "Run_Python_MCP": {
+                "command": "docker",
+                "args": [
+                    "run",
+                    "-i",
+                    "--rm",
+                    "deno-docker:latest",  # image name
+                    "deno",  # the command inside container
+                    "run",
+                    "-N",
+                    "-R=node_modules",
+                    "-W=node_modules",
+                    "--node-modules-dir=auto",
+                    "jsr:@pydantic/mcp-run-python",
+                    "stdio",
+                ],
+                "transport": "stdio",
+            },
+            "duckduckgo_MCP": {
+                "command": "docker",
+                "args": ["run", "-i", "--rm", "mcp/duckduckgo"],
+                "transport": "stdio",
+            },
+            "desktop_commander_in_docker_MCP": {
+                "command": "docker",
+                "args": [
+                    "run",
+                    "-i",
+                    "--rm",
+                    "-v",
+                    "/Users/lorreatlan/Documents/MyPlayDocuments:/mnt/documents",
+                    "mcp/desktop-commander:latest",
+                ],
+                "transport": "stdio",
+            },
+            "Github_MCP": {
+                "command": "docker",
+                "args": [
+                    "run",
+                    "-i",
+                    "--rm",
+                    "-e",
+                    f"GITHUB_PERSONAL_ACCESS_TOKEN={self._github_pat}",
+                    "-e",
+                    "GITHUB_READ-ONLY=1",
+                    "ghcr.io/github/github-mcp-server",
+                ],
+                "transport": "stdio",
+            },
+        }
+        # A server already running over HTTP (e.g. started once with `docker run -d -p ...`)
+        # is reached via streamable_http instead of launching its container ourselves.
+        for name in connections:
+            url = os.getenv(f"{name.upper()}_URL")
+            if url:
+                connections[name] = {"url": url, "transport": "streamable_http"}
+        mcp_client = MultiServerMCPClient(connections)
+
+        # Keep one session (and so one container) per server open for the agent's lifetime;
+        # get_tools() would otherwise start a fresh `docker run --rm` on every tool call.
+        # Servers start concurrently, so startup waits for the slowest one, not the sum.
+        self._mcp_shutdown = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        ready = {name: loop.create_future() for name in connections}
+        self._mcp_tasks = [
+            asyncio.create_task(self._serve_mcp_session(mcp_client, name, ready[name]))
+            for name in connections
+        ]
+        results = await asyncio.gather(*ready.values(), return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            await self._close_mcp_sessions()
+            raise errors[0]
+        mcp_tools = [t for server_tools in results for t in server_tools]
         for tb in mcp_tools:
             print(f"MCP 🔧 {tb.name}")
         return mcp_tools
 
+    async def _serve_mcp_session(self, mcp_client, name: str, ready: asyncio.Future):
+        """
+        Open a session to one MCP server, retrying while it starts up, publish its tools
+        through `ready` and hold the session open until shutdown. Each session lives in its
+        own task because the MCP transports must be exited in the task that entered them.
+        Only connection/startup errors are retried; anything else fails right away.
+        """
+        from langchain_mcp_adapters.tools import load_mcp_tools
+
+        for attempt in range(1, MCP_CONNECT_ATTEMPTS + 1):
+            try:
+                async with mcp_client.session(name) as session:
+                    ready.set_result(await load_mcp_tools(session))
+                    await self._mcp_shutdown.wait()
+                return
+            except Exception as e:
+                if ready.done():
+                    raise
+                if attempt == MCP_CONNECT_ATTEMPTS or not _is_mcp_startup_error(e):
+                    ready.set_exception(e)
+                    return
+                print(f"⏳ MCP server '{name}' not ready ({e}), retrying...")
+                await asyncio.sleep(MCP_CONNECT_RETRY_DELAY)
+
+    async def _close_mcp_sessions(self):
+        """Signal every MCP session task to exit and wait for them."""
+        self._mcp_shutdown.set()
+        await asyncio.gather(*self._mcp_tasks, return_exceptions=True)
+
     # Node: user_input
     def user_input(self, state: AgentState) -> AgentState:
         """
@@ -202,87 +453,170 @@ class Agent:
         """
         self.console.print("[bold cyan]User Input[/bold cyan]: ")
         user_input = self.console.input("> ")
+        # Files may have been edited outside the agent while it waited for input
+        self._drop_file_dependent_results()
         return {"messages": [HumanMessage(content=user_input)]}
 
     # Node: model_response
-    def model_response(self, state: AgentState) -> AgentState:
+    async def model_response(self, state: AgentState) -> AgentState:
         """
         Call the LLM (with tools bound). Print assistant content and any tool_call previews.
         Decide routing via check_tool_use.
         """
-        system_text = """You are a specialised agent for maintaining and developing codebases.
-            ## Development Guidelines:
-
-            1. **Test Failures:**
-            - When tests fail, fix the implementation first, not the tests.
-            - Tests represent expected behavior; implementation should conform to tests
-            - Only modify tests if they clearly don't match specifications
+        # Compose messages: cached static prefix + prior state
+        messages = self._prefix_messages + self._mark_tool_result_breakpoint(
+            state["messages"]
+        )
 
-            2. **Code Changes:**
-            - Make the smallest possible changes to fix issues
-            - Focus on fixing the specific problem rather than rewriting large portions
-            - Add unit tests for all new functionality before implementing it
+        # Stream the reply, re-rendering the assistant panel in place as text arrives so the
+        # first tokens show up immediately instead of after the whole reply has decoded
+        response = None
+        text = ""
+        text_index = None
+        live = None
+        last_render = 0.0
+        try:
+            async for chunk in self.model_with_tools.astream(messages):
+                response = chunk if response is None else response + chunk
+                blocks = (
+                    chunk.content
+                    if isinstance(chunk.content, list)
+                    else [{"type": "text", "text": chunk.content}]
+                )
+                grew = False
+                for block in blocks:
+                    if not (
+                        isinstance(block, dict)
+                        and block.get("type") == "text"
+                        and block.get("text")
+                    ):
+                        continue
+                    # Deltas carry the index of their content block; separate consecutive
+                    # text blocks the way _content_text joins them in the final message
+                    if text and block.get("index") != text_index:
+                        text += "\n\n"
+                    text_index = block.get("index")
+                    text += block["text"]
+                    grew = True
+                if not grew:
+                    continue
+                # Markdown parses its whole input, so rebuild it at most once per refresh
+                now = time.monotonic()
+                if now - last_render < 1 / STREAM_REFRESH_PER_SECOND:
+                    continue
+                last_render = now
+                if live is None:
+                    live = Live(
+                        self._assistant_panel(text),
+                        console=self.console,
+                        refresh_per_second=STREAM_REFRESH_PER_SECOND,
+                    )
+                    live.start()
+                else:
+                    live.update(self._assistant_panel(text))
+        finally:
+            if live is not None:
+                live.update(self._assistant_panel(text), refresh=True)
+                live.stop()
+        if live is None and text:
+            self.console.print(self._assistant_panel(text))
+        response = message_chunk_to_message(response)
+
+        if response.tool_calls:
+            table = Table(title="Tool Use", show_lines=True)
+            table.add_column("Tool", style="cyan", no_wrap=True)
+            table.add_column("Args")
+            for tc in response.tool_calls:
+                table.add_row(tc["name"], Text(json.dumps(tc["args"])))
+            self.console.print(table)
 
-            3. **Best Practices:**
-            - Keep functions small with a single responsibility
-            - Implement proper error handling with appropriate exceptions
-            - Be mindful of configuration dependencies in tests
+        return {"messages": [response]}
 
-            Ask for clarification when needed. Remember to examine test failure messages carefully to understand the root cause before making any changes."""
-        # Compose messages: include prior state
-        messages = [
-            SystemMessage(
-                content=[
-                    {
-                        "type": "text",
-                        "text": system_text,
-                        "cache_control": {"type": "ephemeral"},
-                    }
-                ]
-            ),
-            HumanMessage(content=f"Working directory: {os.getcwd()}"),
-        ] + state.messages
-
-        # Invoke model
-        response = self.model_with_tools.invoke(messages)
-        if isinstance(response.content, list):
-            for item in response.content:
-                if item["type"] == "text":
-                    text = item.get("text", "")
-                    if text:
-                        self.console.print(
-                            Panel.fit(
-                                Markdown(text),
-                                title="[magenta]Assistant[/magenta]",
-                                border_style="magenta",
-                            )
-                        )
-                elif item["type"] == "tool_use":
-                    self.console.print(
-                        Panel.fit(
-                            Markdown(
-                                f"{item["name"]} with args {item.get("args",None)}"
-                            ),
-                            title="Tool Use",
-                        )
-                    )
-        else:
-            self.console.print(
-                Panel.fit(
-                    Markdown(response.content),
-                    title="[magenta]Assistant[/magenta]",
-                )
+    def _mark_tool_result_breakpoint(
+        self, messages: Sequence[BaseMessage]
+    ) -> list[BaseMessage]:
+        """
+        Return messages with a cache breakpoint on the last tool result if it is large.
+        The state itself is left untouched so only the newest result carries the marker.
+        """
+        last = messages[-1] if messages else None
+        if (
+            isinstance(last, ToolMessage)
+            and isinstance(last.content, str)
+            and len(last.content) >= TOOL_RESULT_CACHE_MIN_CHARS
+        ):
+            last = last.model_copy(
+                update={
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": last.content,
+                            "cache_control": {"type": "ephemeral"},
+                        }
+                    ]
+                }
             )
+            return list(messages[:-1]) + [last]
+        return list(messages)
 
-        return {"messages": [response]}
+    def _summarizable(self, messages: Sequence[BaseMessage]) -> list[BaseMessage]:
+        """
+        Return the messages before the last SUMMARY_KEEP_TURNS user turns, which summarize replaces.
+        """
+        turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+        if len(turn_starts) <= SUMMARY_KEEP_TURNS:
+            return []
+        return list(messages[: turn_starts[-SUMMARY_KEEP_TURNS]])
+
+    def _assistant_panel(self, text: str) -> Panel:
+        return Panel(
+            Markdown(text),
+            title="[magenta]Assistant[/magenta]",
+            border_style="magenta",
+        )
+
+    # Node: summarize
+    async def summarize(self, state: AgentState) -> AgentState:
+        """
+        Replace all but the last SUMMARY_KEEP_TURNS user turns with a summary so the
+        prompt sent on each turn stays bounded instead of growing with the session.
+        """
+        old = self._summarizable(state["messages"])
+        if not old:
+            return {"messages": []}
+
+        # The transcript goes in as plain text: the old slice may start with an assistant
+        # message or hold tool results whose tool_use blocks are not part of the request
+        transcript = "\n\n".join(f"[{m.type}] {m.content}" for m in old)
+        summary = await self.model.ainvoke(
+            [SystemMessage(content=SUMMARY_PROMPT), HumanMessage(content=transcript)]
+        )
+        self.console.print("[dim]🗜️ Summarized earlier conversation[/dim]")
+
+        # Reusing the first old message's id replaces it in place, keeping the summary
+        # ahead of the kept turns; add_messages would otherwise append it at the end
+        return {
+            "messages": [
+                HumanMessage(
+                    content=f"Summary of the earlier conversation:\n{_content_text(summary.content)}",
+                    id=old[0].id,
+                )
+            ]
+            + [RemoveMessage(id=m.id) for m in old[1:]]
+        }
 
     # Conditional router
     def check_tool_use(self, state: AgentState) -> str:
         """
-        If the last assistant message has tool_calls, route to 'tool_use', else route to 'user_input'.
+        If the last assistant message has tool_calls, route to 'tool_use'. Otherwise route to
+        'user_input', going through 'summarize' first once the summarizable history exceeds
+        SUMMARY_THRESHOLD_CHARS.
         """
-        if state.messages[-1].tool_calls:
+        if state["messages"][-1].tool_calls:
             return "tool_use"
+        old_chars = sum(len(str(m.content)) for m in self._summarizable(state["messages"]))
+        if old_chars > SUMMARY_THRESHOLD_CHARS:
+            return "summarize"
         return "user_input"
 
     # Node: tool_use
@@ -290,76 +624,124 @@ class Agent:
         """
         Execute tool calls from the last assistant message and return ToolMessage(s),
         preserving tool_call_id so the model can reconcile results when we go back to model_response.
+        Independent tool calls run concurrently; results keep the order of the tool calls.
         """
-        from langgraph.prebuilt import ToolNode
-
-        response = []
-        tools_by_name = {t.name: t for t in self.tools}
-
-        for tc in state.messages[-1].tool_calls:
-            tool_name = tc["name"]
-            tool_args = tc["args"]
-            print(f"🔧 Invoking tool '{tool_name}' with args {tool_args}")
-            tool = tools_by_name.get(tool_name)
-            print(f"🛠️ Found tool: {tool}")
-            tool_node = ToolNode([tool])
-
-            # response = interrupt(
-            #     {
-            #         "action": "review_tool_call",
-            #         "tool_name": tool_name,
-            #         "tool_input": state["messages"][-1].content,
-            #         "message": "Approve this tool call?",
-            #     }
-            # )
-            # # Handle the response after the interrupt (e.g., resume or modify)
-            # if response == "approved":
+        tool_calls = state["messages"][-1].tool_calls
+        results = {}
+        pending = []
+        for tc in tool_calls:
+            print(f"🔧 Invoking tool '{tc['name']}' with args {tc['args']}")
+            print(f"🛠️ Found tool: {self._tools_by_name.get(tc['name'])}")
+            cached = (
+                self._tool_cache.get(_tool_cache_key(tc))
+                if tc["name"] in CACHEABLE_TOOLS
+                else None
+            )
+            if cached is not None:
+                print(f"♻️ Reusing cached result for '{tc['name']}'")
+                # Clear the message id too: add_messages would otherwise replace the
+                # earlier ToolMessage in place instead of appending this answer
+                results[tc["id"]] = cached.model_copy(
+                    update={"tool_call_id": tc["id"], "id": None}
+                )
+            else:
+                pending.append(tc)
+
+        # response = interrupt(
+        #     {
+        #         "action": "review_tool_call",
+        #         "tool_name": tool_name,
+        #         "tool_input": state["messages"][-1].content,
+        #         "message": "Approve this tool call?",
+        #     }
+        # )
+        # # Handle the response after the interrupt (e.g., resume or modify)
+        # if response == "approved":
+        if pending:
             try:
-                tool_result = await tool_node.ainvoke(state)
-                print(f"🛠️ Tool Result: {tool_result}")
-                response.append(tool_result["messages"][0])
-                self.console.print(
-                    Panel.fit(
-                        Syntax(
-                            "\n" + tool_result["messages"][0].content + "\n", "text"
-                        ),
-                        title="Tool Result",
-                    )
+                # ToolNode gathers the calls itself and turns tool exceptions into
+                # ToolMessage(status="error"), so a single invocation covers the whole turn.
+                # It only reads the last AIMessage, so pass just the uncached calls instead
+                # of the full history.
+                tool_result = await self._tool_node.ainvoke(
+                    {"messages": [AIMessage(content="", tool_calls=pending)]}
                 )
+                print(f"🛠️ Tool Result: {tool_result}")
+                for message in tool_result["messages"]:
+                    results[message.tool_call_id] = message
             except Exception as e:
-                response.append(
-                    ToolMessage(
-                        content=f"ERROR: Exception during tool '{tool_name}' execution: {e}",
+                for tc in pending:
+                    results[tc["id"]] = ToolMessage(
+                        content=f"ERROR: Exception during tool '{tc['name']}' execution: {e}",
                         tool_call_id=tc["id"],
+                        status="error",
                     )
-                )
+            self._update_tool_cache(pending, results)
+        # else:
+        #     # Handle rejection or modification
+        #     pass
+        response = [results[tc["id"]] for tc in tool_calls]
+
+        # Render after all calls finish so panels follow tool-call order
+        for message in response:
+            if message.status == "error":
                 self.console.print(
                     Panel.fit(
-                        Markdown(
-                            f"**ERROR**: Exception during tool '{tool_name}' execution: {e}"
-                        ),
+                        Markdown(message.content),
                         title="Tool Error",
                         border_style="red",
                     )
                 )
-            # else:
-            #     # Handle rejection or modification
-            #     pass
+            else:
+                self.console.print(
+                    Panel.fit(
+                        # Plain Text: no lexer pass and no markup parsing of tool output
+                        Text("\n" + message.content + "\n"),
+                        title="Tool Result",
+                    )
+                )
         return {"messages": response}
 
+    def _update_tool_cache(self, tool_calls, results) -> None:
+        """
+        Remember successful read-only results, then drop file-dependent entries if any
+        other tool succeeded in the same turn.
+        """
+        wrote = False
+        for tc in tool_calls:
+            if results[tc["id"]].status == "error":
+                continue
+            if tc["name"] in CACHEABLE_TOOLS:
+                self._tool_cache[_tool_cache_key(tc)] = results[tc["id"]]
+            else:
+                wrote = True
+        if wrote:
+            self._drop_file_dependent_results()
+
+    def _drop_file_dependent_results(self) -> None:
+        self._tool_cache = {
+            key: message
+            for key, message in self._tool_cache.items()
+            if key[0] not in FILE_DEPENDENT_TOOLS
+        }
+
     def print_mermaid_workflow(self):
         """
         Utility: print Mermaid diagram to visualize the graph edges.
         """
+        # The PNG is rendered by a remote API, so cache it per graph definition and only
+        # re-render when the graph changes
+        graph = self.agent.get_graph()
+        mermaid = graph.draw_mermaid()
+        digest = hashlib.sha256(mermaid.encode()).hexdigest()[:16]
+        cached_png = os.path.join(MERMAID_CACHE_DIR, f"langgraph_workflow-{digest}.png")
         try:
-            mermaid = self.agent.get_graph().draw_mermaid_png(
-                output_file_path="langgraph_workflow.png",
-                max_retries=5,
-                retry_delay=2,
-            )
+            if not os.path.exists(cached_png):
+                os.makedirs(MERMAID_CACHE_DIR, exist_ok=True)
+                graph.draw_mermaid_png(output_file_path=cached_png, max_retries=0)
+            shutil.copyfile(cached_png, "langgraph_workflow.png")
         except Exception as e:
             print(f"Error generating mermaid PNG: {e}")
-            mermaid = self.agent.get_graph().draw_mermaid()
             self.console.print(
                 Panel.fit(
                     Syntax(mermaid, "mermaid", theme="monokai", line_numbers=False),
@@ -367,4 +749,57 @@ class Agent:
                     border_style="cyan",
                 )
             )
-            print(self.agent.get_graph().draw_ascii())
+            print(graph.draw_ascii())
+
+
+# The workflow graph is built once at import time and compiled per Agent against its
+# checkpointer. Nodes are plain functions that look up the running Agent in the
+# "agent" key of the run config, so the same graph serves any number of Agents.
+def _agent(config: RunnableConfig) -> Agent:
+    return config["configurable"]["agent"]
+
+
+def _user_input(state: AgentState, config: RunnableConfig) -> AgentState:
+    return _agent(config).user_input(state)
+
+
+async def _model_response(state: AgentState, config: RunnableConfig) -> AgentState:
+    return await _agent(config).model_response(state)
+
+
+async def _tool_use(state: AgentState, config: RunnableConfig) -> AgentState:
+    return await _agent(config).tool_use(state)
+
+
+async def _summarize(state: AgentState, config: RunnableConfig) -> AgentState:
+    return await _agent(config).summarize(state)
+
+
+def _check_tool_use(state: AgentState, config: RunnableConfig) -> str:
+    return _agent(config).check_tool_use(state)
+
+
+WORKFLOW = StateGraph(AgentState)
+
+# Register nodes
+WORKFLOW.add_node("user_input", _user_input)
+WORKFLOW.add_node("model_response", _model_response)
+WORKFLOW.add_node("tool_use", _tool_use)
+WORKFLOW.add_node("summarize", _summarize)
+
+# Edges: start at user_input
+WORKFLOW.set_entry_point("user_input")
+WORKFLOW.add_edge("user_input", "model_response")
+WORKFLOW.add_edge("tool_use", "model_response")
+WORKFLOW.add_edge("summarize", "user_input")
+
+# Conditional: model_response -> tool_use OR -> user_input (via summarize if history is long)
+WORKFLOW.add_conditional_edges(
+    "model_response",
+    _check_tool_use,
+    {
+        "tool_use": "tool_use",
+        "summarize": "summarize",
+        "user_input": "user_input",
+    },
+)
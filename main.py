@@ -1,13 +1,17 @@
 from agent import Agent
 import asyncio
+import os
 
 
 async def async_main():
     agent = Agent()
     await agent.initialize()
-    agent.print_mermaid_workflow()
+    agent.print_greeting()
+    # Drawing the graph calls out to a rendering API; only do it when asked
+    if os.getenv("AGENT_DRAW_GRAPH"):
+        agent.print_mermaid_workflow()
     await agent.run()
-    await agent.close_checkpointer()
+    await agent.aclose()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,77 @@
+import asyncio
+import mmap
+import os
+from collections import OrderedDict
+from typing import Optional
+import aiofiles
+import aiofiles.os
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
+# Bytes returned from the start of a file unless the caller asks for more
+DEFAULT_HEAD_BYTES = 64 * 1024
+# Files larger than this are sliced through mmap instead of being read whole
+MMAP_THRESHOLD_BYTES = 1024 * 1024
+# Number of file slices kept in memory, shared by the sync and async read paths
+CACHE_MAX_ENTRIES = 256
+
+# (path, mtime_ns, size, head_bytes, tail_bytes) -> decoded text, least recently used first.
+# mtime_ns and size are part of the key so an edited file is re-read.
+_cache: OrderedDict[tuple, str] = OrderedDict()
+
 
 class FileReadToolInput(BaseModel):
     file_path: str = Field(..., description="Absolute path to the file to read")
+    head_bytes: Optional[int] = Field(
+        DEFAULT_HEAD_BYTES,
+        ge=0,
+        description="Number of bytes to return from the start of the file; null for the whole file",
+    )
+    tail_bytes: int = Field(
+        0, ge=0, description="Number of bytes to also return from the end of the file"
+    )
+
+
+def _slice(data, size: int, head_bytes: Optional[int], tail_bytes: int) -> bytes:
+    """
+    Return the requested head/tail of `data`, or all of it when they cover the file.
+    """
+    if head_bytes is None or head_bytes + tail_bytes >= size:
+        return data[:]
+    omitted = size - head_bytes - tail_bytes
+    parts = [data[:head_bytes], f"\n... [{omitted} bytes omitted] ...\n".encode()]
+    if tail_bytes:
+        parts.append(data[size - tail_bytes :])
+    return b"".join(parts)
+
+
+def _cache_get(key: tuple) -> Optional[str]:
+    text = _cache.get(key)
+    if text is not None:
+        _cache.move_to_end(key)
+    return text
+
+
+def _cache_put(key: tuple, text: str) -> str:
+    _cache[key] = text
+    if len(_cache) > CACHE_MAX_ENTRIES:
+        _cache.popitem(last=False)
+    return text
+
+
+def _read_slice(
+    file_path: str, size: int, head_bytes: Optional[int], tail_bytes: int
+) -> str:
+    """
+    Read (part of) a file, slicing large files through mmap.
+    """
+    with open(file_path, "rb") as f:
+        if size > MMAP_THRESHOLD_BYTES:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = _slice(mm, size, head_bytes, tail_bytes)
+        else:
+            data = _slice(f.read(), size, head_bytes, tail_bytes)
+    return data.decode("utf-8", "replace")
 
 
 class FileReadTool(BaseTool):
@@ -11,13 +79,52 @@ class FileReadTool(BaseTool):
     description: str = (
         "Reads a file designated by the supplied absolute path and returns the content as string. "
         "If the path is not absolute, the tool will attempt to resolve it against the provided working directory. "
+        "Only the first head_bytes (64 KiB by default) are returned; pass head_bytes=null for the whole file "
+        "or tail_bytes to also see its end. "
         "Handle errors gracefully and return a helpful message when the file cannot be found or opened."
     )
     args_schema: type = FileReadToolInput
 
-    def _run(self, file_path: str) -> str:
+    def _run(
+        self,
+        file_path: str,
+        head_bytes: Optional[int] = DEFAULT_HEAD_BYTES,
+        tail_bytes: int = 0,
+    ) -> str:
         """
         Synchronous tool run. Reads file content. Returns text or an error message.
         """
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        st = os.stat(file_path)
+        key = (file_path, st.st_mtime_ns, st.st_size, head_bytes, tail_bytes)
+        text = _cache_get(key)
+        if text is None:
+            text = _cache_put(
+                key, _read_slice(file_path, st.st_size, head_bytes, tail_bytes)
+            )
+        return text
+
+    async def _arun(
+        self,
+        file_path: str,
+        head_bytes: Optional[int] = DEFAULT_HEAD_BYTES,
+        tail_bytes: int = 0,
+    ) -> str:
+        """
+        Asynchronous tool run. Keeps the event loop free while reading; aiofiles still runs
+        each stat/open/read in a worker thread, so this is not fewer thread hops than _run.
+        """
+        st = await aiofiles.os.stat(file_path)
+        key = (file_path, st.st_mtime_ns, st.st_size, head_bytes, tail_bytes)
+        text = _cache_get(key)
+        if text is not None:
+            return text
+        if st.st_size > MMAP_THRESHOLD_BYTES:
+            # mmap slicing has no async API; keep it off the event loop
+            text = await asyncio.to_thread(
+                _read_slice, file_path, st.st_size, head_bytes, tail_bytes
+            )
+        else:
+            async with aiofiles.open(file_path, "rb") as f:
+                data = _slice(await f.read(), st.st_size, head_bytes, tail_bytes)
+            text = data.decode("utf-8", "replace")
+        return _cache_put(key, text)
@@ -1,11 +1,41 @@
-import subprocess
+import asyncio
 from langchain.tools import tool
+from langchain_core.tools import ToolException
+
+# Bytes read from pytest's output per chunk
+READ_CHUNK_BYTES = 64 * 1024
 
 
 @tool
-def run_unit_tests() -> str:
-    """Run unit tests using uv."""
-    result = subprocess.run(
-        ["uv", "run", "pytest", "-xvs", "tests/"], capture_output=True, text=True
+async def run_unit_tests(timeout: float = 600.0) -> str:
+    """Run unit tests using uv. Stops after the first failure or after `timeout` seconds."""
+    proc = await asyncio.create_subprocess_exec(
+        "uv",
+        "run",
+        "pytest",
+        "-xvs",
+        "tests/",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
     )
-    return result.stdout
+    # Output is collected as it arrives, so a timeout can still report which test hung
+    output = bytearray()
+
+    async def collect() -> None:
+        while chunk := await proc.stdout.read(READ_CHUNK_BYTES):
+            output.extend(chunk)
+        await proc.wait()
+
+    try:
+        await asyncio.wait_for(collect(), timeout=timeout)
+    except asyncio.TimeoutError:
+        raise ToolException(
+            f"Unit tests did not finish within {timeout} seconds. Output so far:\n"
+            + output.decode(errors="replace")
+        )
+    finally:
+        # Also reached when the tool call is cancelled; never leave pytest running
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+    return output.decode(errors="replace")